@@ -1,28 +1,114 @@
 #!/usr/bin/env python3
 import argparse
-import subprocess
 import csv
+import functools
+import hashlib
+import json
+import os
 import sys
+import tempfile
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
 
+import boto3
+from botocore import UNSIGNED
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
-def list_s3_files(s3_path, allow_missing=False, no_sign_request=False):
-    """List files at an S3 path using the AWS CLI."""
+# Retry throttled or failed list calls with backoff
+_S3_CONFIG = Config(retries={"mode": "adaptive", "max_attempts": 10})
+
+DEFAULT_LIST_CACHE_DIR = os.path.expanduser("~/.cache/nao-read-sizer")
+DEFAULT_LIST_CACHE_TTL = 3600
+# ListObjectsV2 maximum, to minimize round trips
+S3_LIST_PAGE_SIZE = 1000
+
+# One row of a sample sheet; field order matches the CSV columns
+Sample = namedtuple("Sample", "id fastq_1 fastq_2 outdir")
+
+# Raw FASTQ filename suffixes and the read each one holds
+READ_SUFFIXES = (("_1.fastq.gz", "R1"), ("_2.fastq.gz", "R2"))
+
+
+@functools.lru_cache(maxsize=2)
+def _get_s3_client(no_sign_request=False):
+    """Return the shared S3 client for the given signing mode."""
+    config = _S3_CONFIG
+    if no_sign_request:
+        config = config.merge(Config(signature_version=UNSIGNED))
+    return boto3.client("s3", config=config)
+
+
+def _listing_cache_path(cache_dir, s3_path):
+    return os.path.join(cache_dir, hashlib.sha1(s3_path.encode()).hexdigest() + ".json")
+
+
+def _load_cached_listing(cache_dir, s3_path, ttl):
+    """Return a cached listing of s3_path if one exists and is fresher than ttl seconds."""
+    path = _listing_cache_path(cache_dir, s3_path)
     try:
-        cmd = ["aws", "s3", "ls", s3_path]
-        if no_sign_request:
-            cmd.append("--no-sign-request")
-            
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, check=True
-        )
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cached_listing(cache_dir, s3_path, files):
+    """Atomically write a listing of s3_path to the cache, warning instead of failing."""
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            json.dump(files, f)
+        os.replace(tmp_path, _listing_cache_path(cache_dir, s3_path))
+    except OSError as e:
+        sys.stderr.write(f"Warning: Could not cache listing of {s3_path}: {e}\n")
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def list_s3_files(s3_path, allow_missing=False, no_sign_request=False,
+                  cache_dir=None, cache_ttl=DEFAULT_LIST_CACHE_TTL):
+    """
+    List files directly under an S3 path (like `aws s3 ls`).
+
+    If cache_dir is set, a listing cached there within the last cache_ttl
+    seconds is returned without contacting S3, and fresh listings are cached.
+    """
+    if cache_dir is not None:
+        cached = _load_cached_listing(cache_dir, s3_path, cache_ttl)
+        if cached is not None:
+            return cached
+
+    parsed = urlparse(s3_path)
+    bucket, prefix = parsed.netloc, parsed.path.lstrip("/")
+    try:
+        paginator = _get_s3_client(no_sign_request).get_paginator("list_objects_v2")
         files = []
-        for line in result.stdout.strip().splitlines():
-            parts = line.split()
-            if len(parts) >= 4:
-                filename = parts[-1]
-                files.append(filename)
-        return files
-    except subprocess.CalledProcessError as e:
+        found = False
+        pages = paginator.paginate(
+            Bucket=bucket, Prefix=prefix, Delimiter="/",
+            PaginationConfig={"PageSize": S3_LIST_PAGE_SIZE},
+        )
+        for page in pages:
+            if page.get("Contents") or page.get("CommonPrefixes"):
+                found = True
+            # Only keys are kept; other object metadata is dropped with the page
+            for obj in page.get("Contents", []):
+                filename = obj["Key"].rsplit("/", 1)[-1]
+                if filename:
+                    files.append(filename)
+        if not found:
+            # `aws s3 ls` fails on an empty prefix; keep treating it as missing
+            raise FileNotFoundError(f"No objects found under {s3_path}")
+    except (ClientError, BotoCoreError, FileNotFoundError) as e:
         if allow_missing:
             sys.stderr.write(
                 f"Warning: Could not list {s3_path}. Assuming directory is missing.\n"
@@ -32,8 +118,13 @@ def list_s3_files(s3_path, allow_missing=False, no_sign_request=False):
             sys.stderr.write(f"Error listing {s3_path}: {e}\n")
             sys.exit(1)
 
+    if cache_dir is not None:
+        _save_cached_listing(cache_dir, s3_path, files)
+    return files
 
-def generate_samplesheet(bucket, delivery, outdir=None, ignore_existing=False, no_sign_request=False):
+
+def generate_samplesheet(bucket, delivery, outdir=None, ignore_existing=False, no_sign_request=False,
+                         list_cache_dir=None, list_cache_ttl=DEFAULT_LIST_CACHE_TTL):
     """
     Generate sample sheet data from raw FASTQ files and existing SIZ files.
 
@@ -42,52 +133,65 @@ def generate_samplesheet(bucket, delivery, outdir=None, ignore_existing=False, n
         delivery: Delivery folder name
         outdir: Custom output directory (default: s3://bucket/delivery/siz/)
         ignore_existing: If True, ignore existing SIZ files and include all FASTQ pairs
-        no_sign_request: Use --no-sign-request flag with AWS CLI commands
+        no_sign_request: Make unsigned S3 requests (for public buckets)
+        list_cache_dir: Directory for caching the raw file listing (default: no caching).
+            Existing SIZ files are always listed fresh.
+        list_cache_ttl: Maximum age in seconds of a cached listing to reuse
 
     Returns:
-        List of dicts with keys: id, fastq_1, fastq_2, outdir
+        Iterator of Sample(id, fastq_1, fastq_2, outdir) tuples, in the order each
+        pair completes in the raw listing. S3 is listed when this is called;
+        samples are produced lazily as the iterator is consumed.
     """
     # Lookup existing raw and SIZ files
     raw_dir = f"s3://{bucket}/{delivery}/raw/"
     siz_dir = f"s3://{bucket}/{delivery}/siz/" if outdir is None else outdir
-    raw_files = list_s3_files(raw_dir, allow_missing=False, no_sign_request=no_sign_request)
-    siz_files = list_s3_files(siz_dir, allow_missing=True, no_sign_request=no_sign_request)
+    raw_files = list_s3_files(raw_dir, allow_missing=False, no_sign_request=no_sign_request,
+                              cache_dir=list_cache_dir, cache_ttl=list_cache_ttl)
+
+    # If we're ignoring existing, we don't need to list or compute already processed ids
+    if ignore_existing:
+        ids_to_skip = set()
+    else:
+        # Never cached: a stale listing would resubmit (and overwrite) finished samples
+        siz_files = list_s3_files(siz_dir, allow_missing=True, no_sign_request=no_sign_request)
+        ids_to_skip = {f.partition("_chunk")[0] for f in siz_files if "_chunk" in f}
+
+    return _iter_samples(raw_files, raw_dir, ids_to_skip, siz_dir)
+
+
+def _iter_samples(raw_files, raw_dir, ids_to_skip, siz_dir):
+    """
+    Yield a sample for each complete read pair in raw_files whose id isn't skipped.
 
-    # Build dictionary of ids from raw files
-    ids = {}
+    Samples are yielded in the order their pairs complete, i.e. when the second
+    mate appears in raw_files. This is not necessarily the order in which ids
+    first appear, even for sorted listings (e.g. A_1.fastq.gz, A_1_1.fastq.gz,
+    A_1_2.fastq.gz, A_2.fastq.gz yields A_1 before A).
+    """
+    # id -> path of the one mate seen so far, for ids whose pair isn't complete yet
+    partial = {}
     for f in raw_files:
-        if f.endswith("_1.fastq.gz"):
-            id = f[: -len("_1.fastq.gz")]
-            ids.setdefault(id, {})["R1"] = raw_dir + f
-        elif f.endswith("_2.fastq.gz"):
-            id = f[: -len("_2.fastq.gz")]
-            ids.setdefault(id, {})["R2"] = raw_dir + f
-
-    ids_to_skip = set()
-    # If we're ignoring existing, we don't need to compute already processed ids
-    if not ignore_existing:
-        for f in siz_files:
-            if "_chunk" in f:
-                id = f.partition("_chunk")[0]
-                ids_to_skip.add(id)
-
-    # Build sample list
-    samples = []
-    for id, reads in ids.items():
+        for suffix, read in READ_SUFFIXES:
+            if f.endswith(suffix):
+                break
+        else:
+            continue
+
+        id = f[: -len(suffix)]
         if id in ids_to_skip:
             continue
 
-        if "R1" in reads and "R2" in reads:
-            samples.append({
-                "id": id,
-                "fastq_1": reads["R1"],
-                "fastq_2": reads["R2"],
-                "outdir": siz_dir
-            })
+        mate = partial.pop(id, None)
+        if mate is None:
+            partial[id] = raw_dir + f
+        elif read == "R1":
+            yield Sample(id, raw_dir + f, mate, siz_dir)
         else:
-            sys.stderr.write(f"Warning: Incomplete pair for id {id}\n")
+            yield Sample(id, mate, raw_dir + f, siz_dir)
 
-    return samples
+    for id in partial:
+        sys.stderr.write(f"Warning: Incomplete pair for id {id}\n")
 
 
 def main():
@@ -107,13 +211,25 @@ def main():
     parser.add_argument(
         "--no-sign-request",
         action="store_true",
-        help="Use --no-sign-request flag with AWS CLI commands (for public repositories)"
+        help="Make unsigned S3 requests (for public repositories)"
     )
     parser.add_argument(
         "--ignore-existing",
         action="store_true",
         help="Ignore existing SIZ files; sample sheet will include all FASTQ pairs"
     )
+    parser.add_argument(
+        "--list-cache-dir",
+        nargs="?",
+        const=DEFAULT_LIST_CACHE_DIR,
+        help=f"Cache the raw FASTQ listing in this directory; existing SIZ files are always re-listed (default if given without a value: {DEFAULT_LIST_CACHE_DIR})"
+    )
+    parser.add_argument(
+        "--list-cache-ttl",
+        type=int,
+        default=DEFAULT_LIST_CACHE_TTL,
+        help=f"Reuse a cached raw FASTQ listing up to this many seconds old (default: {DEFAULT_LIST_CACHE_TTL})"
+    )
     args = parser.parse_args()
 
     # Generate samples using the extracted function
@@ -122,16 +238,16 @@ def main():
         args.delivery,
         args.outdir,
         args.ignore_existing,
-        args.no_sign_request
+        args.no_sign_request,
+        args.list_cache_dir,
+        args.list_cache_ttl
     )
 
-    # Write sample sheet to CSV
-    with open(args.output, "w", newline="") as csvfile:
+    # Write sample sheet to CSV, streaming samples straight to the writer
+    with open(args.output, "w", newline="", buffering=1 << 20) as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["id", "fastq_1", "fastq_2", "outdir"])
-
-        for sample in samples:
-            writer.writerow([sample["id"], sample["fastq_1"], sample["fastq_2"], sample["outdir"]])
+        writer.writerow(Sample._fields)
+        writer.writerows(samples)
 
     print(f"Sample sheet written to {args.output}")
 
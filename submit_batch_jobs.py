@@ -10,46 +10,108 @@ Usage:
 
 import argparse
 import boto3
+from botocore.config import Config
 import csv
+import functools
 import shlex
 import sys
 import time
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional
 from datetime import datetime
 
 # Import existing samplesheet generation logic
 try:
-    from scripts.generate_samplesheet import generate_samplesheet
+    from scripts.generate_samplesheet import (
+        DEFAULT_LIST_CACHE_DIR, DEFAULT_LIST_CACHE_TTL, Sample, generate_samplesheet
+    )
 except ImportError:
     print("Error: Could not import scripts.generate_samplesheet", file=sys.stderr)
     print("Make sure scripts/generate_samplesheet.py exists", file=sys.stderr)
     sys.exit(1)
 
-
-def submit_batch_job(batch_client, sample: Dict, job_queue: str, job_definition: str,
+# Shared across threads; sized so concurrent submit/describe calls reuse warm connections
+_BATCH_CONFIG = Config(max_pool_connections=64, retries={"mode": "adaptive", "max_attempts": 10})
+
+# Bounds (seconds) for the adaptive describe_jobs polling interval
+MIN_POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 30.0
+
+# Minimum seconds between describe_jobs calls for a job, by its last-seen status.
+# Queued jobs change slowly; unknown statuses (e.g. new jobs) are always polled.
+STATUS_POLL_INTERVALS = {
+    "SUBMITTED": 30.0,
+    "PENDING": 30.0,
+    "RUNNABLE": 30.0,
+    "STARTING": 5.0,
+    "RUNNING": 5.0,
+}
+
+# Container command for one sample; fields other than the numeric options must be shell-quoted
+SIZER_COMMAND_TEMPLATE = (
+    "set -e -o pipefail; "
+    "sizer.sh -s /usr/local/bin/split_interleave_fastqs -u /sequence_tools/compress_upload.sh "
+    "-c {chunk_size} -l {zstd_level} "
+    "<(aws s3 cp {fastq_1} - | gunzip) <(aws s3 cp {fastq_2} - | gunzip) "
+    "{id} {output_prefix}"
+)
+
+# Number of concurrent submit_job calls when submitting a batch of samples
+SUBMIT_WORKERS = 32
+
+
+@functools.lru_cache(maxsize=1)
+def get_batch_client():
+    """Return the shared AWS Batch client."""
+    return boto3.client('batch', config=_BATCH_CONFIG)
+
+
+def load_sample_sheet(path: str) -> List[Sample]:
+    """Read a sample sheet CSV, matching columns by header name."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        missing = [field for field in Sample._fields if field not in header]
+        if missing:
+            raise ValueError(f"{path} is missing column(s): {', '.join(missing)}")
+        columns = itemgetter(*(header.index(field) for field in Sample._fields))
+        samples = []
+        for row in reader:
+            # Skip blank lines, as csv.DictReader does
+            if not row:
+                continue
+            if len(row) < len(header):
+                raise ValueError(
+                    f"{path} line {reader.line_num} has {len(row)} column(s), expected {len(header)}"
+                )
+            samples.append(Sample._make(columns(row)))
+        return samples
+
+
+def submit_batch_job(batch_client, sample: Sample, job_queue: str, job_definition: str,
                      chunk_size: int, zstd_level: int, dry_run: bool = False) -> str:
     """Submit a single sizer job to AWS Batch."""
     command = [
         "/bin/bash", "-c",
-        f"""set -e -o pipefail
-        sizer.sh -s /usr/local/bin/split_interleave_fastqs \\
-            -u /sequence_tools/compress_upload.sh \\
-            -c {chunk_size} \\
-            -l {zstd_level} \\
-            <(aws s3 cp {shlex.quote(sample['fastq_1'])} - | gunzip) \\
-            <(aws s3 cp {shlex.quote(sample['fastq_2'])} - | gunzip) \\
-            {shlex.quote(sample['id'])} \\
-            {shlex.quote(sample['outdir'] + sample['id'])}
-        """
+        SIZER_COMMAND_TEMPLATE.format(
+            chunk_size=chunk_size,
+            zstd_level=zstd_level,
+            fastq_1=shlex.quote(sample.fastq_1),
+            fastq_2=shlex.quote(sample.fastq_2),
+            id=shlex.quote(sample.id),
+            output_prefix=shlex.quote(sample.outdir + sample.id),
+        )
     ]
 
     if dry_run:
-        print(f"[DRY RUN] Would submit job: sizer-{sample['id']}")
-        print(f"  Command: {command[2].strip()}")
-        return f"dry-run-{sample['id']}"
+        print(f"[DRY RUN] Would submit job: sizer-{sample.id}")
+        print(f"  Command: {command[2]}")
+        return f"dry-run-{sample.id}"
 
     response = batch_client.submit_job(
-        jobName=f"sizer-{sample['id']}",
+        jobName=f"sizer-{sample.id}",
         jobQueue=job_queue,
         jobDefinition=job_definition,
         containerOverrides={"command": command}
@@ -57,37 +119,99 @@ def submit_batch_job(batch_client, sample: Dict, job_queue: str, job_definition:
     return response['jobId']
 
 
+def new_tracker_entry(sample: Sample, retry_count: int = 0) -> Dict:
+    """Return a job_tracker entry for a newly submitted job that hasn't been polled yet."""
+    return {
+        "sample": sample, "retry_count": retry_count,
+        "last_status": None, "last_poll": float("-inf")
+    }
+
+
+def submit_samples(batch_client, samples: Iterable[Sample], job_tracker: Dict, job_queue: str,
+                   job_definition: str, chunk_size: int, zstd_level: int,
+                   dry_run: bool = False) -> List[str]:
+    """Submit samples concurrently and add them to job_tracker. Returns the new job IDs."""
+    def submit(sample):
+        return sample, submit_batch_job(
+            batch_client, sample, job_queue, job_definition,
+            chunk_size, zstd_level, dry_run
+        )
+
+    # Submit concurrently over the shared client; dry runs stay serial so output isn't interleaved
+    with ThreadPoolExecutor(max_workers=1 if dry_run else SUBMIT_WORKERS) as executor:
+        results = list(executor.map(submit, samples))
+
+    # job_tracker is only updated from the calling thread
+    for sample, job_id in results:
+        job_tracker[job_id] = new_tracker_entry(sample)
+        if not dry_run:
+            print(f"  Submitted {sample.id} -> {job_id}")
+    return [job_id for _, job_id in results]
+
+
 def monitor_jobs(batch_client, job_tracker: Dict, max_retries: int,
-                job_queue: str, job_definition: str, chunk_size: int, zstd_level: int) -> List[str]:
+                job_queue: str, job_definition: str, chunk_size: int, zstd_level: int,
+                pending: Optional[Iterator[Sample]] = None,
+                max_inflight: Optional[int] = None) -> List[str]:
     """
     Monitor running jobs and retry failures.
 
-    job_tracker format: {job_id: {"sample": sample_dict, "retry_count": int}}
+    job_tracker format: {job_id: {"sample": Sample, "retry_count": int}}
+    monitor_jobs adds "last_status" and "last_poll" to each entry, so that jobs
+    are only re-described once their status has had time to change.
+
+    If pending and max_inflight are given, samples from pending are submitted
+    as tracked jobs finish, keeping at most max_inflight jobs (including
+    retries) in job_tracker.
 
     Returns:
         List of sample IDs that failed permanently.
     """
     failed_permanently = []
+    # Fill in any fields missing from entries built by the caller
+    for meta in job_tracker.values():
+        meta.update({**new_tracker_entry(meta["sample"], meta["retry_count"]), **meta})
+    interval = MIN_POLL_INTERVAL
+    idle_cycles = 0
+    # Tracked job ids, only rebuilt when jobs finish or are resubmitted
+    job_ids = list(job_tracker)
 
     while job_tracker:
-        time.sleep(10)
-
-        # Batch describe_jobs calls (up to 100 at a time)
-        job_ids = list(job_tracker.keys())
-        for i in range(0, len(job_ids), 100):
-            if i > 0:
-                time.sleep(0.25)
-            batch_ids = job_ids[i:i+100]
-            response = batch_client.describe_jobs(jobs=batch_ids)
-
+        time.sleep(interval)
+        changed = False
+        finished = set()
+        resubmitted = []
+
+        # Only describe jobs whose last-seen status has had time to change
+        now = time.monotonic()
+        to_poll = [
+            job_id for job_id in job_ids
+            if now - job_tracker[job_id]["last_poll"]
+            >= STATUS_POLL_INTERVALS.get(job_tracker[job_id]["last_status"], 0)
+        ]
+
+        # Batch describe_jobs calls (up to 100 at a time), issued concurrently;
+        # responses are processed here so job_tracker is only touched by one thread
+        chunks = [to_poll[i:i+100] for i in range(0, len(to_poll), 100)]
+        responses = []
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(16, len(chunks))) as executor:
+                responses = list(executor.map(lambda c: batch_client.describe_jobs(jobs=c), chunks))
+
+        for response in responses:
             for job_info in response['jobs']:
                 job_id = job_info['jobId']
-                sample_id = job_tracker[job_id]['sample']['id']
+                sample_id = job_tracker[job_id]['sample'].id
                 status = job_info['status']
+                job_tracker[job_id]["last_poll"] = now
+                if job_tracker[job_id]["last_status"] != status:
+                    job_tracker[job_id]["last_status"] = status
+                    changed = True
 
                 if status == 'SUCCEEDED':
                     print(f"✓ {sample_id} succeeded")
                     del job_tracker[job_id]
+                    finished.add(job_id)
 
                 elif status == 'FAILED':
                     retry_count = job_tracker[job_id]['retry_count']
@@ -101,12 +225,36 @@ def monitor_jobs(batch_client, job_tracker: Dict, max_retries: int,
                             batch_client, sample, job_queue, job_definition,
                             chunk_size, zstd_level
                         )
-                        job_tracker[new_job_id] = {"sample": sample, "retry_count": retry_count + 1}
-                        del job_tracker[job_id]
+                        job_tracker[new_job_id] = new_tracker_entry(sample, retry_count + 1)
+                        resubmitted.append(new_job_id)
                     else:
                         print(f"✗ {sample_id} failed permanently after {max_retries + 1} attempts - Reason: {reason}")
                         failed_permanently.append(sample_id)
-                        del job_tracker[job_id]
+                    del job_tracker[job_id]
+                    finished.add(job_id)
+
+        if finished or resubmitted:
+            job_ids = [job_id for job_id in job_ids if job_id not in finished] + resubmitted
+
+        # Refill the submission window from pending samples
+        if pending is not None and max_inflight is not None and len(job_tracker) < max_inflight:
+            wanted = max_inflight - len(job_tracker)
+            new_job_ids = submit_samples(
+                batch_client, islice(pending, wanted), job_tracker,
+                job_queue, job_definition, chunk_size, zstd_level
+            )
+            job_ids.extend(new_job_ids)
+            # A short refill means pending is exhausted; stop trying
+            if len(new_job_ids) < wanted:
+                pending = None
+
+        # Poll faster while jobs are transitioning, back off while nothing changes
+        if changed:
+            interval = max(MIN_POLL_INTERVAL, interval * 0.5)
+            idle_cycles = 0
+        elif interval < MAX_POLL_INTERVAL:
+            idle_cycles += 1
+            interval = min(MAX_POLL_INTERVAL, MIN_POLL_INTERVAL * (1.5 ** idle_cycles))
 
     return failed_permanently
 
@@ -134,72 +282,94 @@ def main():
     parser.add_argument("--zstd-level", type=int, default=15, help="Zstd compression level (default: 15)")
     parser.add_argument("--max-retries", type=int, default=3, help="Max retry attempts per job (default: 3)")
     parser.add_argument("--dry-run", action="store_true", help="Print jobs without submitting")
+    parser.add_argument(
+        "--max-concurrent-inflight", type=int, default=500,
+        help="Max jobs submitted and not yet finished at once; more are submitted as jobs finish (default: 500)"
+    )
     parser.add_argument(
         "--no-sign-request",
         action="store_true",
-        help="Use --no-sign-request for S3 operations (for public repositories)"
+        help="Make unsigned S3 requests (for public repositories)"
     )
     parser.add_argument(
         "--ignore-existing",
         action="store_true",
         help="Ignore existing SIZ files; process all FASTQ pairs"
     )
+    parser.add_argument(
+        "--list-cache-dir",
+        nargs="?",
+        const=DEFAULT_LIST_CACHE_DIR,
+        help=f"Cache the raw FASTQ listing in this directory; existing SIZ files are always re-listed (default if given without a value: {DEFAULT_LIST_CACHE_DIR})"
+    )
+    parser.add_argument(
+        "--list-cache-ttl",
+        type=int,
+        default=DEFAULT_LIST_CACHE_TTL,
+        help=f"Reuse a cached raw FASTQ listing up to this many seconds old (default: {DEFAULT_LIST_CACHE_TTL})"
+    )
 
     args = parser.parse_args()
 
     # Validate bucket/delivery pairing
     if args.bucket and not args.delivery:
         parser.error("--delivery is required when using --bucket")
+    if args.max_concurrent_inflight < 1:
+        parser.error("--max-concurrent-inflight must be at least 1")
 
     # Get samples
     print(f"READ-SIZER PIPELINE - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
 
     if args.sample_sheet:
         print(f"Loading samples from {args.sample_sheet}...")
-        with open(args.sample_sheet) as f:
-            samples = list(csv.DictReader(f))
+        try:
+            samples = load_sample_sheet(args.sample_sheet)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
     else:
         print(f"Generating samplesheet from s3://{args.bucket}/{args.delivery}...")
         samples = generate_samplesheet(
             args.bucket, args.delivery, args.outdir,
-            args.ignore_existing, args.no_sign_request
+            args.ignore_existing, args.no_sign_request,
+            args.list_cache_dir, args.list_cache_ttl
         )
 
+    # Collect generated samples so incomplete-pair warnings print before submission
+    samples = list(samples)
     if not samples:
         print("No samples to process")
         sys.exit(0)
 
     print(f"Found {len(samples)} sample(s) to process\n")
 
-    # Submit all jobs
-    batch_client = boto3.client('batch')
+    # Submit the first window of jobs; dry runs "submit" everything at once
+    batch_client = get_batch_client()
     job_tracker = {}
+    max_inflight = None if args.dry_run else args.max_concurrent_inflight
+    pending = iter(samples)
 
     print("Submitting jobs...")
-    for sample in samples:
-        job_id = submit_batch_job(
-            batch_client, sample, args.job_queue, args.job_definition,
-            args.chunk_size, args.zstd_level, args.dry_run
-        )
-        job_tracker[job_id] = {"sample": sample, "retry_count": 0}
-        if not args.dry_run:
-            print(f"  Submitted {sample['id']} -> {job_id}")
+    submit_samples(
+        batch_client, islice(pending, max_inflight), job_tracker, args.job_queue,
+        args.job_definition, args.chunk_size, args.zstd_level, args.dry_run
+    )
 
     if args.dry_run:
         print("\nDry run complete - no jobs were actually submitted")
         sys.exit(0)
 
     print(f"\nMonitoring {len(job_tracker)} job(s)...\n")
-    total_jobs = len(job_tracker)
 
-    # Monitor and retry
+    # Monitor and retry, submitting remaining samples as jobs finish
     failed = monitor_jobs(
         batch_client, job_tracker, args.max_retries,
-        args.job_queue, args.job_definition, args.chunk_size, args.zstd_level
+        args.job_queue, args.job_definition, args.chunk_size, args.zstd_level,
+        pending=pending, max_inflight=max_inflight
     )
 
     # Print summary
-    succeeded = total_jobs - len(failed)
+    succeeded = len(samples) - len(failed)
     if failed:
         print(f"\n{succeeded} succeeded, {len(failed)} failed permanently")
         sys.exit(1)
@@ -1,7 +1,98 @@
 """Simple tests for generate_samplesheet.py"""
 import pytest
-from unittest.mock import patch, call
-from scripts.generate_samplesheet import generate_samplesheet
+from unittest.mock import MagicMock, patch, call
+from botocore.exceptions import ClientError
+from scripts.generate_samplesheet import generate_samplesheet, list_s3_files
+
+
+def mock_s3_client(pages=None, error=None):
+    client = MagicMock()
+    paginator = client.get_paginator.return_value
+    if error is not None:
+        paginator.paginate.side_effect = error
+    else:
+        paginator.paginate.return_value = pages
+    return client
+
+
+class TestListS3Files:
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_lists_files_across_pages(self, mock_get_client):
+        mock_get_client.return_value = mock_s3_client(pages=[
+            {'Contents': [{'Key': 'delivery/raw/sample1_1.fastq.gz'}],
+             'CommonPrefixes': [{'Prefix': 'delivery/raw/nested/'}]},
+            {'Contents': [{'Key': 'delivery/raw/sample1_2.fastq.gz'}]},
+        ])
+
+        files = list_s3_files('s3://bucket/delivery/raw/')
+
+        assert files == ['sample1_1.fastq.gz', 'sample1_2.fastq.gz']
+        mock_get_client.return_value.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='bucket', Prefix='delivery/raw/', Delimiter='/',
+            PaginationConfig={'PageSize': 1000}
+        )
+
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_missing_bucket_allowed(self, mock_get_client):
+        error = ClientError({'Error': {'Code': 'NoSuchBucket'}}, 'ListObjectsV2')
+        mock_get_client.return_value = mock_s3_client(error=error)
+
+        assert list_s3_files('s3://bucket/delivery/siz/', allow_missing=True) == []
+
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_empty_prefix_treated_as_missing(self, mock_get_client):
+        mock_get_client.return_value = mock_s3_client(pages=[{'KeyCount': 0}])
+
+        assert list_s3_files('s3://bucket/delivery/siz/', allow_missing=True) == []
+        with pytest.raises(SystemExit):
+            list_s3_files('s3://bucket/delivery/raw/', allow_missing=False)
+
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_reuses_cached_listing(self, mock_get_client, tmp_path):
+        mock_get_client.return_value = mock_s3_client(pages=[
+            {'Contents': [{'Key': 'delivery/raw/sample1_1.fastq.gz'}]},
+        ])
+
+        first = list_s3_files('s3://bucket/delivery/raw/', cache_dir=str(tmp_path))
+        second = list_s3_files('s3://bucket/delivery/raw/', cache_dir=str(tmp_path))
+
+        assert first == second == ['sample1_1.fastq.gz']
+        assert mock_get_client.return_value.get_paginator.call_count == 1
+
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_ignores_expired_cached_listing(self, mock_get_client, tmp_path):
+        mock_get_client.return_value = mock_s3_client(pages=[
+            {'Contents': [{'Key': 'delivery/raw/sample1_1.fastq.gz'}]},
+        ])
+
+        list_s3_files('s3://bucket/delivery/raw/', cache_dir=str(tmp_path))
+        list_s3_files('s3://bucket/delivery/raw/', cache_dir=str(tmp_path), cache_ttl=-1)
+
+        assert mock_get_client.return_value.get_paginator.call_count == 2
+
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_cache_write_failure_still_returns_listing(self, mock_get_client, tmp_path):
+        mock_get_client.return_value = mock_s3_client(pages=[
+            {'Contents': [{'Key': 'delivery/raw/sample1_1.fastq.gz'}]},
+        ])
+
+        with patch('scripts.generate_samplesheet.os.replace', side_effect=OSError('disk full')):
+            files = list_s3_files('s3://bucket/delivery/raw/', cache_dir=str(tmp_path))
+
+        assert files == ['sample1_1.fastq.gz']
+        assert list(tmp_path.iterdir()) == []  # temp file cleaned up
+
+    @patch('scripts.generate_samplesheet._get_s3_client')
+    def test_unusable_cache_dir_still_returns_listing(self, mock_get_client, tmp_path):
+        mock_get_client.return_value = mock_s3_client(pages=[
+            {'Contents': [{'Key': 'delivery/raw/sample1_1.fastq.gz'}]},
+        ])
+        not_a_dir = tmp_path / 'file'
+        not_a_dir.write_text('')
+
+        files = list_s3_files('s3://bucket/delivery/raw/', cache_dir=str(not_a_dir / 'cache'))
+
+        assert files == ['sample1_1.fastq.gz']
 
 
 class TestGenerateSamplesheet:
@@ -13,13 +104,13 @@ class TestGenerateSamplesheet:
             []  # no siz files
         ]
 
-        samples = generate_samplesheet('bucket', 'delivery')
+        samples = list(generate_samplesheet('bucket', 'delivery'))
 
         assert len(samples) == 1
-        assert samples[0]['id'] == 'sample1'
-        assert samples[0]['fastq_1'] == 's3://bucket/delivery/raw/sample1_1.fastq.gz'
-        assert samples[0]['fastq_2'] == 's3://bucket/delivery/raw/sample1_2.fastq.gz'
-        assert samples[0]['outdir'] == 's3://bucket/delivery/siz/'
+        assert samples[0].id == 'sample1'
+        assert samples[0].fastq_1 == 's3://bucket/delivery/raw/sample1_1.fastq.gz'
+        assert samples[0].fastq_2 == 's3://bucket/delivery/raw/sample1_2.fastq.gz'
+        assert samples[0].outdir == 's3://bucket/delivery/siz/'
 
     @pytest.mark.parametrize("outdir", [None, 's3://other-bucket/results/siz/'])
     @patch('scripts.generate_samplesheet.list_s3_files')
@@ -30,10 +121,10 @@ class TestGenerateSamplesheet:
             ['sample1_chunk000000.fastq.zst']  # sample1 already processed
         ]
 
-        samples = generate_samplesheet('bucket', 'delivery', outdir=outdir)
+        samples = list(generate_samplesheet('bucket', 'delivery', outdir=outdir))
 
         assert len(samples) == 1
-        assert samples[0]['id'] == 'sample2'
+        assert samples[0].id == 'sample2'
 
     @patch('scripts.generate_samplesheet.list_s3_files')
     def test_ignore_existing_flag(self, mock_list_s3):
@@ -42,10 +133,12 @@ class TestGenerateSamplesheet:
             ['sample1_chunk000000.fastq.zst']
         ]
 
-        samples = generate_samplesheet('bucket', 'delivery', ignore_existing=True)
+        samples = list(generate_samplesheet('bucket', 'delivery', ignore_existing=True))
 
         assert len(samples) == 1  # Should include sample1 despite existing siz
-        assert samples[0]['id'] == 'sample1'
+        assert samples[0].id == 'sample1'
+        # Existing SIZ files aren't listed at all
+        assert mock_list_s3.call_count == 1
 
     @patch('scripts.generate_samplesheet.list_s3_files')
     def test_custom_outdir(self, mock_list_s3):
@@ -55,16 +148,29 @@ class TestGenerateSamplesheet:
         ]
 
         custom_outdir = 's3://other-bucket/results/siz/'
-        samples = generate_samplesheet('bucket', 'delivery', outdir=custom_outdir)
+        samples = list(generate_samplesheet('bucket', 'delivery', outdir=custom_outdir))
 
         assert len(samples) == 1
-        assert samples[0]['outdir'] == custom_outdir
+        assert samples[0].outdir == custom_outdir
         # Verify existing-file lookup used the custom outdir, not the default
         mock_list_s3.assert_has_calls([
-            call('s3://bucket/delivery/raw/', allow_missing=False, no_sign_request=False),
+            call('s3://bucket/delivery/raw/', allow_missing=False, no_sign_request=False,
+                 cache_dir=None, cache_ttl=3600),
             call(custom_outdir, allow_missing=True, no_sign_request=False),
         ])
 
+    @patch('scripts.generate_samplesheet.list_s3_files')
+    def test_caches_only_raw_listing(self, mock_list_s3):
+        mock_list_s3.side_effect = [['sample1_1.fastq.gz', 'sample1_2.fastq.gz'], []]
+
+        list(generate_samplesheet('bucket', 'delivery', list_cache_dir='/tmp/cache', list_cache_ttl=60))
+
+        mock_list_s3.assert_has_calls([
+            call('s3://bucket/delivery/raw/', allow_missing=False, no_sign_request=False,
+                 cache_dir='/tmp/cache', cache_ttl=60),
+            call('s3://bucket/delivery/siz/', allow_missing=True, no_sign_request=False),
+        ])
+
     @patch('scripts.generate_samplesheet.list_s3_files')
     def test_skips_incomplete_pairs(self, mock_list_s3):
         mock_list_s3.side_effect = [
@@ -72,6 +178,35 @@ class TestGenerateSamplesheet:
             []
         ]
 
-        samples = generate_samplesheet('bucket', 'delivery')
+        samples = list(generate_samplesheet('bucket', 'delivery'))
 
         assert len(samples) == 0
+
+    @patch('scripts.generate_samplesheet.list_s3_files')
+    def test_pairs_mates_in_any_order(self, mock_list_s3):
+        mock_list_s3.side_effect = [
+            ['sample2_2.fastq.gz', 'sample1_1.fastq.gz', 'notes.txt',
+             'sample2_1.fastq.gz', 'sample1_2.fastq.gz'],
+            []
+        ]
+
+        samples = list(generate_samplesheet('bucket', 'delivery'))
+
+        assert [(s.id, s.fastq_1, s.fastq_2) for s in samples] == [
+            ('sample2', 's3://bucket/delivery/raw/sample2_1.fastq.gz', 's3://bucket/delivery/raw/sample2_2.fastq.gz'),
+            ('sample1', 's3://bucket/delivery/raw/sample1_1.fastq.gz', 's3://bucket/delivery/raw/sample1_2.fastq.gz'),
+        ]
+
+    @patch('scripts.generate_samplesheet.list_s3_files')
+    def test_emits_samples_as_pairs_complete(self, mock_list_s3):
+        # Sorted listing where an id's name is a prefix of another's
+        mock_list_s3.side_effect = [
+            ['A_1.fastq.gz', 'A_1_1.fastq.gz', 'A_1_2.fastq.gz', 'A_2.fastq.gz'],
+            []
+        ]
+
+        samples = list(generate_samplesheet('bucket', 'delivery'))
+
+        assert [s.id for s in samples] == ['A_1', 'A']
+        assert samples[1].fastq_1 == 's3://bucket/delivery/raw/A_1.fastq.gz'
+        assert samples[1].fastq_2 == 's3://bucket/delivery/raw/A_2.fastq.gz'
@@ -1,7 +1,60 @@
 """Simple tests for submit_batch_jobs.py"""
 import pytest
+from contextlib import contextmanager
 from unittest.mock import MagicMock, patch
-from submit_batch_jobs import submit_batch_job, monitor_jobs
+from pathlib import Path
+from scripts.generate_samplesheet import Sample
+from submit_batch_jobs import load_sample_sheet, submit_batch_job, submit_samples, monitor_jobs
+
+
+@contextmanager
+def fake_clock():
+    """Patch time.sleep to advance a fake time.monotonic; yields the slept intervals."""
+    intervals = []
+    with patch('time.sleep', side_effect=intervals.append), \
+            patch('time.monotonic', side_effect=lambda: sum(intervals)):
+        yield intervals
+
+
+class TestLoadSampleSheet:
+    def test_loads_samples(self):
+        samples = load_sample_sheet(Path(__file__).parent / 'data' / 'test_samplesheet.csv')
+
+        assert samples == [Sample(
+            id='test_sample',
+            fastq_1='s3://nao-testing/read-sizer/raw/test01_1.fastq.gz',
+            fastq_2='s3://nao-testing/read-sizer/raw/test01_2.fastq.gz',
+            outdir='/tmp/'
+        )]
+
+    def test_matches_columns_by_name(self, tmp_path):
+        sheet = tmp_path / 'samples.csv'
+        sheet.write_text('outdir,id,notes,fastq_2,fastq_1\ns3://out/,s1,x,r2.fastq.gz,r1.fastq.gz\n')
+
+        assert load_sample_sheet(sheet) == [Sample('s1', 'r1.fastq.gz', 'r2.fastq.gz', 's3://out/')]
+
+    def test_missing_column(self, tmp_path):
+        sheet = tmp_path / 'samples.csv'
+        sheet.write_text('id,fastq_1,outdir\ns1,r1.fastq.gz,s3://out/\n')
+
+        with pytest.raises(ValueError, match='fastq_2'):
+            load_sample_sheet(sheet)
+
+    def test_skips_blank_lines(self, tmp_path):
+        sheet = tmp_path / 'samples.csv'
+        sheet.write_text('id,fastq_1,fastq_2,outdir\ns1,a_1,a_2,out/\n\ns2,b_1,b_2,out/\n')
+
+        assert load_sample_sheet(sheet) == [
+            Sample('s1', 'a_1', 'a_2', 'out/'),
+            Sample('s2', 'b_1', 'b_2', 'out/'),
+        ]
+
+    def test_short_row(self, tmp_path):
+        sheet = tmp_path / 'samples.csv'
+        sheet.write_text('id,fastq_1,fastq_2,outdir\ns1,a_1,a_2,out/\ns2,b_1\n')
+
+        with pytest.raises(ValueError, match='line 3'):
+            load_sample_sheet(sheet)
 
 
 class TestSubmitBatchJob:
@@ -9,12 +62,12 @@ class TestSubmitBatchJob:
         mock_batch = MagicMock()
         mock_batch.submit_job.return_value = {'jobId': 'job-123'}
 
-        sample = {
-            'id': 'test-sample',
-            'fastq_1': 's3://bucket/raw/test_1.fastq.gz',
-            'fastq_2': 's3://bucket/raw/test_2.fastq.gz',
-            'outdir': 's3://bucket/siz/'
-        }
+        sample = Sample(
+            id='test-sample',
+            fastq_1='s3://bucket/raw/test_1.fastq.gz',
+            fastq_2='s3://bucket/raw/test_2.fastq.gz',
+            outdir='s3://bucket/siz/'
+        )
 
         job_id = submit_batch_job(mock_batch, sample, 'queue', 'job-def', 1000000, 15)
 
@@ -24,15 +77,35 @@ class TestSubmitBatchJob:
         assert call_args['jobName'] == 'sizer-test-sample'
         assert call_args['jobQueue'] == 'queue'
         assert call_args['jobDefinition'] == 'job-def'
+        assert call_args['containerOverrides']['command'] == [
+            '/bin/bash', '-c',
+            'set -e -o pipefail; '
+            'sizer.sh -s /usr/local/bin/split_interleave_fastqs -u /sequence_tools/compress_upload.sh '
+            '-c 1000000 -l 15 '
+            '<(aws s3 cp s3://bucket/raw/test_1.fastq.gz - | gunzip) '
+            '<(aws s3 cp s3://bucket/raw/test_2.fastq.gz - | gunzip) '
+            'test-sample s3://bucket/siz/test-sample'
+        ]
+
+    def test_quotes_sample_fields_in_command(self):
+        mock_batch = MagicMock()
+        mock_batch.submit_job.return_value = {'jobId': 'job-123'}
+        sample = Sample("it's", 's3://bucket/raw/a b_1.fastq.gz', 's3://bucket/raw/a b_2.fastq.gz', 's3://bucket/siz/')
+
+        submit_batch_job(mock_batch, sample, 'queue', 'job-def', 1000000, 15)
+
+        command = mock_batch.submit_job.call_args[1]['containerOverrides']['command'][2]
+        assert "aws s3 cp 's3://bucket/raw/a b_1.fastq.gz' -" in command
+        assert command.endswith(""" 'it'"'"'s' 's3://bucket/siz/it'"'"'s'""")
 
     def test_dry_run_returns_mock_job_id(self):
         mock_batch = MagicMock()
-        sample = {
-            'id': 'test-sample',
-            'fastq_1': 's3://bucket/raw/test_1.fastq.gz',
-            'fastq_2': 's3://bucket/raw/test_2.fastq.gz',
-            'outdir': 's3://bucket/siz/'
-        }
+        sample = Sample(
+            id='test-sample',
+            fastq_1='s3://bucket/raw/test_1.fastq.gz',
+            fastq_2='s3://bucket/raw/test_2.fastq.gz',
+            outdir='s3://bucket/siz/'
+        )
 
         job_id = submit_batch_job(mock_batch, sample, 'queue', 'job-def', 1000000, 5, dry_run=True)
 
@@ -40,6 +113,20 @@ class TestSubmitBatchJob:
         mock_batch.submit_job.assert_not_called()
 
 
+class TestSubmitSamples:
+    def test_tracks_submitted_jobs(self):
+        mock_batch = MagicMock()
+        mock_batch.submit_job.side_effect = lambda jobName, **kwargs: {'jobId': f'job-{jobName}'}
+        samples = [Sample(f's{i}', 'r1', 'r2', 'out/') for i in range(3)]
+        job_tracker = {}
+
+        job_ids = submit_samples(mock_batch, samples, job_tracker, 'queue', 'def', 1000000, 15)
+
+        assert job_ids == ['job-sizer-s0', 'job-sizer-s1', 'job-sizer-s2']
+        assert [job_tracker[job_id]['sample'] for job_id in job_ids] == samples
+        assert all(meta['retry_count'] == 0 for meta in job_tracker.values())
+
+
 class TestMonitorJobs:
     def test_retries_failed_job(self):
         mock_batch = MagicMock()
@@ -51,12 +138,12 @@ class TestMonitorJobs:
         ]
         mock_batch.submit_job.return_value = {'jobId': 'job-456'}
 
-        sample = {
-            'id': 'test',
-            'fastq_1': 's3://bucket/raw/test_1.fastq.gz',
-            'fastq_2': 's3://bucket/raw/test_2.fastq.gz',
-            'outdir': 's3://bucket/siz/'
-        }
+        sample = Sample(
+            id='test',
+            fastq_1='s3://bucket/raw/test_1.fastq.gz',
+            fastq_2='s3://bucket/raw/test_2.fastq.gz',
+            outdir='s3://bucket/siz/'
+        )
         job_tracker = {
             'job-123': {'sample': sample, 'retry_count': 0}
         }
@@ -74,12 +161,12 @@ class TestMonitorJobs:
             'jobs': [{'status': 'FAILED', 'statusReason': 'Error', 'jobId': 'job-123'}]
         }
 
-        sample = {
-            'id': 'test',
-            'fastq_1': 's3://bucket/raw/test_1.fastq.gz',
-            'fastq_2': 's3://bucket/raw/test_2.fastq.gz',
-            'outdir': 's3://bucket/siz/'
-        }
+        sample = Sample(
+            id='test',
+            fastq_1='s3://bucket/raw/test_1.fastq.gz',
+            fastq_2='s3://bucket/raw/test_2.fastq.gz',
+            outdir='s3://bucket/siz/'
+        )
         job_tracker = {
             'job-123': {'sample': sample, 'retry_count': 3}  # Already at max
         }
@@ -90,3 +177,106 @@ class TestMonitorJobs:
         # Should not retry, just remove from tracker
         mock_batch.submit_job.assert_not_called()
         assert len(job_tracker) == 0
+
+    def test_describes_jobs_in_batches_of_100(self):
+        mock_batch = MagicMock()
+        mock_batch.describe_jobs.side_effect = lambda jobs: {
+            'jobs': [{'status': 'SUCCEEDED', 'jobId': job_id} for job_id in jobs]
+        }
+
+        job_tracker = {
+            f'job-{i}': {'sample': Sample(f'sample{i}', 'r1', 'r2', 'out/'), 'retry_count': 0}
+            for i in range(250)
+        }
+
+        with patch('time.sleep'):
+            failed = monitor_jobs(mock_batch, job_tracker, 3, 'queue', 'def', 1000000, 15)
+
+        assert failed == []
+        assert len(job_tracker) == 0
+        batch_sizes = sorted(len(c.kwargs['jobs']) for c in mock_batch.describe_jobs.call_args_list)
+        assert batch_sizes == [50, 100, 100]
+
+    def test_backs_off_while_idle(self):
+        mock_batch = MagicMock()
+        mock_batch.describe_jobs.side_effect = [
+            {'jobs': [{'status': 'RUNNING', 'jobId': 'job-123'}]},
+            {'jobs': [{'status': 'RUNNING', 'jobId': 'job-123'}]},
+            {'jobs': [{'status': 'RUNNING', 'jobId': 'job-123'}]},
+            {'jobs': [{'status': 'SUCCEEDED', 'jobId': 'job-123'}]},
+        ]
+        job_tracker = {'job-123': {'sample': Sample('test', 'r1', 'r2', 'out/'), 'retry_count': 0}}
+
+        with fake_clock() as intervals:
+            monitor_jobs(mock_batch, job_tracker, 3, 'queue', 'def', 1000000, 15)
+
+        # Unchanged cycles back off; RUNNING jobs are re-described at most every 5s
+        assert intervals == [2.0, 2.0, 3.0, 4.5, 6.75, 10.125]
+        assert mock_batch.describe_jobs.call_count == 4
+
+    def test_polls_queued_jobs_less_often(self):
+        mock_batch = MagicMock()
+        mock_batch.describe_jobs.side_effect = [
+            {'jobs': [{'status': 'RUNNABLE', 'jobId': 'job-123'}]},
+            {'jobs': [{'status': 'SUCCEEDED', 'jobId': 'job-123'}]},
+        ]
+        job_tracker = {'job-123': {'sample': Sample('test', 'r1', 'r2', 'out/'), 'retry_count': 0}}
+
+        with fake_clock() as intervals:
+            monitor_jobs(mock_batch, job_tracker, 3, 'queue', 'def', 1000000, 15)
+
+        # Second describe waits until 30s after the RUNNABLE poll at t=2
+        assert sum(intervals) >= 32.0
+        assert mock_batch.describe_jobs.call_count == 2
+
+    def test_submits_pending_samples_as_window_frees(self):
+        mock_batch = MagicMock()
+        mock_batch.submit_job.side_effect = lambda jobName, **kwargs: {'jobId': f'job-{jobName}'}
+        mock_batch.describe_jobs.side_effect = lambda jobs: {
+            'jobs': [{'status': 'SUCCEEDED', 'jobId': job_id} for job_id in jobs]
+        }
+        pending = iter([Sample(f's{i}', 'r1', 'r2', 'out/') for i in range(1, 5)])
+        job_tracker = {'job-sizer-s0': {'sample': Sample('s0', 'r1', 'r2', 'out/'), 'retry_count': 0}}
+
+        with patch('time.sleep'):
+            failed = monitor_jobs(mock_batch, job_tracker, 3, 'queue', 'def', 1000000, 15,
+                                  pending=pending, max_inflight=2)
+
+        assert failed == []
+        assert len(job_tracker) == 0
+        assert mock_batch.submit_job.call_count == 4
+        # Never more than max_inflight jobs described at once
+        assert all(len(c.kwargs['jobs']) <= 2 for c in mock_batch.describe_jobs.call_args_list)
+
+    def test_stops_refilling_once_pending_is_exhausted(self):
+        mock_batch = MagicMock()
+        mock_batch.submit_job.side_effect = lambda jobName, **kwargs: {'jobId': f'job-{jobName}'}
+        # Jobs stay RUNNING for a few polls before succeeding
+        statuses = iter(['RUNNING'] * 4 + ['SUCCEEDED'] * 10)
+        mock_batch.describe_jobs.side_effect = lambda jobs: {
+            'jobs': [{'status': next(statuses), 'jobId': job_id} for job_id in jobs]
+        }
+        pending = iter([Sample('s1', 'r1', 'r2', 'out/')])
+        job_tracker = {'job-sizer-s0': {'sample': Sample('s0', 'r1', 'r2', 'out/'), 'retry_count': 0}}
+
+        with fake_clock(), patch('submit_batch_jobs.submit_samples', wraps=submit_samples) as mock_submit:
+            monitor_jobs(mock_batch, job_tracker, 3, 'queue', 'def', 1000000, 15,
+                         pending=pending, max_inflight=5)
+
+        # The first refill comes up short, so no empty refills follow
+        assert mock_submit.call_count == 1
+        assert len(job_tracker) == 0
+
+    def test_ignores_pending_without_max_inflight(self):
+        mock_batch = MagicMock()
+        mock_batch.describe_jobs.return_value = {
+            'jobs': [{'status': 'SUCCEEDED', 'jobId': 'job-123'}]
+        }
+        job_tracker = {'job-123': {'sample': Sample('test', 'r1', 'r2', 'out/'), 'retry_count': 0}}
+
+        with patch('time.sleep'):
+            monitor_jobs(mock_batch, job_tracker, 3, 'queue', 'def', 1000000, 15,
+                         pending=iter([Sample('s1', 'r1', 'r2', 'out/')]))
+
+        mock_batch.submit_job.assert_not_called()
+        assert len(job_tracker) == 0